@@ -6,6 +6,8 @@ from pathlib import Path
 #  ASM -> bytes for your CPU8Bit
 # =========================
 
+# Опкоды. Сюда не входят псевдо-инструкции INC16/DEC16 (см. PSEUDO16 ниже):
+# они раскрываются в 23 байта обычных команд и портят A, B и флаги.
 OP = {
     "LDI":   0b00000001,
     "LDI16": 0b00000010,
@@ -70,9 +72,22 @@ REG.update({
     "P": 15,
 })
 
+# Псевдо-инструкции u16 ++/-- над переменной в памяти: INC16 lo, hi / DEC16 lo, hi.
+# Раскрываются в
+#   LDM B, lo / LDM A, hi / INC|DEC B / JNZ|JNC done / INC|DEC A / done: STM lo, B / STM hi, A
+# (портят A, B и флаги). Значение: (операция, переход "без переноса").
+PSEUDO16 = {
+    "INC16": ("INC", "JNZ"),
+    "DEC16": ("DEC", "JNC"),
+}
+# длины частей раскрытия: LDM, LDM, INC|DEC, JNZ|JNC, INC|DEC | STM, STM
+PSEUDO16_HEAD_LEN = 4 + 4 + 2 + 3 + 2  # до метки done
+PSEUDO16_TAIL_LEN = 4 + 4              # done: два STM
+PSEUDO16_LEN = PSEUDO16_HEAD_LEN + PSEUDO16_TAIL_LEN
+
 COMMENT_RE = re.compile(r"(;|#|//).*?$")
 
-@dataclass
+@dataclass(slots=True)
 class SrcLine:
     lineno: int
     raw: str
@@ -183,6 +198,9 @@ def estimate_len(tokens):
     if head == "LDI16":
         return 5
 
+    if head in PSEUDO16:
+        return PSEUDO16_LEN
+
     if head in ("LDM","STM","LDR","STR"):
         return 4
 
@@ -246,6 +264,22 @@ def assemble_text(asm_text: str):
                     emit_u8(out, v)
             continue
 
+        if ins in PSEUDO16:
+            step, skip = PSEUDO16[ins]
+            lo = parse_value(tok[1], labels)
+            hi = parse_value(tok[2], labels)
+            ra, rb = REG["A"], REG["B"]
+            # адрес "done": сразу после INC|DEC A, перед двумя STM
+            done = ln.addr + PSEUDO16_HEAD_LEN
+            emit_u8(out, OP["LDM"]); emit_u8(out, rb); emit_u16_lohi(out, lo)
+            emit_u8(out, OP["LDM"]); emit_u8(out, ra); emit_u16_lohi(out, hi)
+            emit_u8(out, OP[step]); emit_u8(out, rb)
+            emit_u8(out, OP[skip]); emit_u16_lohi(out, done)
+            emit_u8(out, OP[step]); emit_u8(out, ra)
+            emit_u8(out, OP["STM"]); emit_u16_lohi(out, lo); emit_u8(out, rb)
+            emit_u8(out, OP["STM"]); emit_u16_lohi(out, hi); emit_u8(out, ra)
+            continue
+
         if ins not in OP:
             raise ValueError(f"Неизвестная инструкция {ins} (строка {ln.lineno})")
 
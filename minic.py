@@ -1,9 +1,11 @@
 # highlang_compiler.py
 import re
 import sys
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import chain
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict, Any
+from typing import Callable, List, NoReturn, Tuple, Optional, Dict, Any, Deque, Iterable, Iterator, Union, Set, TextIO
 
 # =========================
 # CHAR MAP (from your CPU)
@@ -31,115 +33,247 @@ CHAR_MAP = {
     81: "#", 82: "[", 83: "]", 84: "{", 85: "}",
 }
 CHAR_TO_CODE = {v: k for k, v in CHAR_MAP.items() if v != ""}
+# direct table for Latin-1 chars (0 = not in CHAR_MAP; code 0 is the empty glyph);
+# the Cyrillic letters and other code points above 255 go through CHAR_TO_CODE
+_CHAR_CODE_LATIN1 = bytearray(256)
+for _ch, _code in CHAR_TO_CODE.items():
+    if ord(_ch) < 256:
+        _CHAR_CODE_LATIN1[ord(_ch)] = _code
+del _ch, _code
+
+def char_code(ch: str, line: int,
+              _latin1: bytearray = _CHAR_CODE_LATIN1, _other: Dict[str, int] = CHAR_TO_CODE) -> int:
+    # the tables are bound as defaults so lookups are fast locals, not globals
+    o = ord(ch)
+    code = _latin1[o] if o < 256 else _other.get(ch, 0)
+    if not code:
+        raise ValueError(f"Unknown char {ch!r} at line {line} (not in CHAR_MAP)")
+    return code
 
 # =========================
 # Tokenizer
 # =========================
+# whitespace and comments
+_SKIP_SRC = r"(?:\s+|//[^\n]*|;[^\n]*|\#[^\n]*)*"
+_SKIP_RE = re.compile(_SKIP_SRC)
+
+# every match is: the skippable run before a token (SKIP, possibly empty) + the token.
+# SKIP is captured inside a lookahead, which re never backtracks into, so a failing
+# token after a long run cannot blow up. Token alternatives are ordered by how often
+# they occur; keywords come out of IDENT via _KEYWORDS, and only at a word boundary
+# (only `let:` needs its own alternative because of the colon).
 TOKEN_RE = re.compile(
     r"""
-    (?P<WS>\s+)
-  | (?P<COMMENT>//[^\n]*|;[^\n]*|\#[^\n]*)
-  | (?P<LET>\blet:)
-  | (?P<IF>\bif\b)
-  | (?P<ELSE>\belse\b)
-  | (?P<WHILE>\bwhile\b)
-  | (?P<REG>\breg\b)
-  | (?P<MEM>\bmem\b)
-  | (?P<NOT>\bnot\b)
-  | (?P<IN>\bin\b)
-  | (?P<OUT>\bout\b)
-  | (?P<TYPE>\bu8\b|\bu16\b|\bchar\b)
-  | (?P<BIN>0b[01]+)
-  | (?P<NUM>\d+)
-  | (?P<CHARLIT>'[^']')
+    (?=(?P<SKIP>""" + _SKIP_SRC + r"""))(?P=SKIP)
+  (?:
+    (?P<LET>\blet:)
+  | (?P<IDENT>[A-Za-z_]\w*)
   | (?P<OP>\+\+|--|\+=|-=|&=|\|=|\^=|<<=|>>=|==|!=|<=|>=|<<|>>|=|<|>)
-  | (?P<LBRACE>\{)
-  | (?P<RBRACE>\})
   | (?P<LPAREN>\()
   | (?P<RPAREN>\))
+  | (?P<LBRACE>\{)
+  | (?P<RBRACE>\})
   | (?P<LBRACK>\[)
   | (?P<RBRACK>\])
   | (?P<COMMA>,)
-  | (?P<FUNC>\bfunc\b)
-  | (?P<RETURN>\breturn\b)
-  | (?P<CALL>\bcall\b)
+  | (?P<BIN>0b[01]+)
+  | (?P<NUM>\d+)
+  | (?P<CHARLIT>'[^']')
   | (?P<COLON>:)
-   | (?P<HALT>\bhalt\b)
-  | (?P<IDENT>[A-Za-z_]\w*)
-
-
+  )
     """,
     re.VERBOSE,
 )
 
-@dataclass
+_KEYWORDS = {
+    "if": "IF", "else": "ELSE", "while": "WHILE",
+    "reg": "REG", "mem": "MEM", "not": "NOT", "in": "IN", "out": "OUT",
+    "u8": "TYPE", "u16": "TYPE", "char": "TYPE",
+    "func": "FUNC", "return": "RETURN", "call": "CALL", "halt": "HALT",
+}
+
+# token kinds whose text repeats (keywords, names, punctuation): one shared str per spelling
+_INTERN_KINDS = frozenset((
+    "LET", "IF", "ELSE", "WHILE", "REG", "MEM", "NOT", "IN", "OUT", "TYPE", "OP",
+    "LBRACE", "RBRACE", "LPAREN", "RPAREN", "LBRACK", "RBRACK", "COMMA",
+    "FUNC", "RETURN", "CALL", "COLON", "HALT", "IDENT",
+))
+_intern = sys.intern
+
+# OP text -> Token.op_kind
+_OP_KINDS = {
+    "=": "assign",
+    "+=": "compound", "-=": "compound", "&=": "compound", "|=": "compound",
+    "^=": "compound", "<<=": "compound", ">>=": "compound",
+    "==": "cmp", "!=": "cmp", "<": "cmp", ">": "cmp", "<=": "cmp", ">=": "cmp",
+    "++": "postfix", "--": "postfix",
+}
+
+@dataclass(slots=True)
 class Token:
     kind: str
     text: str
     line: int
     col: int
-
-def tokenize(src: str) -> List[Token]:
-    out: List[Token] = []
-    i = 0
+    # text.upper() for IDENT (register names are case-insensitive), else text
+    text_upper: str
+    # numeric value of NUM/BIN, converted once by the tokenizer
+    value: Optional[int] = None
+    # OP only: 'assign' / 'compound' / 'cmp' / 'postfix' (None for << and >>)
+    op_kind: Optional[str] = None
+
+def iter_tokens(src: str) -> Iterator[Token]:
+    # anchored scanner: each match starts where the previous one ended and
+    # the scan stops at the first char no token accepts
+    pos = 0
     line = 1
-    col = 1
-    while i < len(src):
-        m = TOKEN_RE.match(src, i)
-        if not m:
-            raise SyntaxError(f"Unexpected char {src[i]!r} at line {line}, col {col}")
+    line_start = 0  # offset of the first char of `line`
+    last_line = last_col = 1
+    uppers: Dict[str, str] = {}  # IDENT text -> interned upper-case spelling
+    for m in iter(TOKEN_RE.scanner(src).match, None):
         kind = m.lastgroup
+        start = m.start(kind)
+        if start != pos:
+            # skipped whitespace/comments; comments stop before their newline
+            nl = src.rfind("\n", pos, start)
+            if nl >= 0:
+                line += src.count("\n", pos, nl + 1)
+                line_start = nl + 1
         text = m.group(kind)
-        if kind in ("WS", "COMMENT"):
-            newlines = text.count("\n")
-            if newlines:
-                line += newlines
-                col = 1 + len(text) - (text.rfind("\n") + 1)
-            else:
-                col += len(text)
-            i = m.end()
-            continue
-        out.append(Token(kind, text, line, col))
-        col += len(text)
-        i = m.end()
-    return out
+        pos = m.end()
+        upper = text
+        value = op_kind = None
+        if kind == "NUM":
+            value = int(text)
+        elif kind == "BIN":
+            value = int(text[2:], 2)
+        elif kind in _INTERN_KINDS:
+            text = upper = _intern(text)
+            if kind == "OP":
+                op_kind = _OP_KINDS.get(text)
+            elif kind == "IDENT":
+                kw = _KEYWORDS.get(text)
+                # a keyword needs a word boundary before it, as `\bwhile\b` did:
+                # in `0while` the word right after the number stays an IDENT
+                if kw is not None and not (start and (src[start - 1].isalnum() or src[start - 1] == "_")):
+                    kind = kw
+                else:
+                    upper = uppers.get(text)
+                    if upper is None:
+                        upper = uppers[text] = _intern(text.upper())
+        last_line, last_col = line, start - line_start + 1
+        yield Token(kind, text, last_line, last_col, upper, value, op_kind)
+
+    # trailing whitespace/comments, or the run before an invalid char
+    end = _SKIP_RE.match(src, pos).end()
+    if end < len(src):
+        nl = src.rfind("\n", pos, end)
+        if nl >= 0:
+            line += src.count("\n", pos, nl + 1)
+            line_start = nl + 1
+        raise SyntaxError(f"Unexpected char {src[end]!r} at line {line}, col {end - line_start + 1}")
+
+    # sentinel: the parser never runs past it, EOF errors point at the last token
+    yield Token("EOF", "", last_line, last_col, "")
+
+def tokenize(src: str) -> List[Token]:
+    return list(iter_tokens(src))
 
 # =========================
 # AST nodes
 # =========================
-@dataclass
+@dataclass(slots=True)
 class VarDecl:
     name: str
     vtype: str
     line: int
 
-@dataclass
+@dataclass(slots=True)
 class Operand:
-    # kind: 'num','char','var','reg','regpair','mem','in','call'
+    # kind: 'num','var','reg','regpair','mem','in','call' (char literals arrive as 'num')
     kind: str
     value: Any
     line: int
+    # Codegen inline cache for 'var': VarInfo resolved at scope generation cache_gen
+    cache_gen: int = field(default=-1, repr=False, compare=False)
+    cache_info: Optional["VarInfo"] = field(default=None, repr=False, compare=False)
+    # 8 or 16 once Codegen.width_of has seen the node (0 = not computed yet)
+    width: int = field(default=0, repr=False, compare=False)
+
+# parse_operand hands out these shared instances for literals 0..255;
+# codegen only caches value-derived data on them and never reports a line for a number
+SMALL_INT_OPERANDS: Dict[int, Operand] = {n: Operand("num", n, 0) for n in range(256)}
 
-@dataclass
+@dataclass(slots=True)
 class Target:
     # kind: 'var','reg','regpair','mem'
     kind: str
     value: Any
     line: int
+    cache_gen: int = field(default=-1, repr=False, compare=False)
+    cache_info: Optional["VarInfo"] = field(default=None, repr=False, compare=False)
+    width: int = field(default=0, repr=False, compare=False)
+
+@dataclass(slots=True)
+class Cond:
+    left: Operand
+    op: str
+    right: Operand
+    line: int
 
-@dataclass
+@dataclass(slots=True)
+class CallData:
+    # Operand("call", CallData(...))
+    name: str
+    args: List[Operand]
+
+# Stmt.data payloads, one per statement kind
+@dataclass(slots=True)
+class IfData:
+    cond: Cond
+    then: List["Stmt"]
+    else_: Optional[List["Stmt"]]
+
+@dataclass(slots=True)
+class WhileData:
+    cond: Cond
+    body: List["Stmt"]
+
+@dataclass(slots=True)
+class OutData:
+    port: Operand
+    val: Operand
+
+@dataclass(slots=True)
+class AssignData:
+    # 'assign' and 'assign_not'
+    target: Target
+    rhs: Operand
+
+@dataclass(slots=True)
+class OpAssignData:
+    target: Target
+    op: str
+    rhs: Operand
+
+@dataclass(slots=True)
+class PostfixData:
+    target: Target
+    op: str
+
+@dataclass(slots=True)
 class Stmt:
     kind: str
-    data: Any
+    data: Any  # VarDecl / *Data above / Operand for 'return' / None for 'halt'
     line: int
 
-@dataclass
+@dataclass(slots=True)
 class Param:
     name: str
     ptype: str
     line: int
 
-@dataclass
+@dataclass(slots=True)
 class FuncDef:
     name: str
     params: List[Param]
@@ -147,48 +281,123 @@ class FuncDef:
     ret: Stmt            # Stmt(kind='return', data=Operand)
     line: int
 
-@dataclass
+@dataclass(slots=True)
 class Program:
     funcs: List[FuncDef]
     main: List[Stmt]
 
+# register names, and every two-letter HI/LO pair of them
+_REGS = frozenset("ABCDEFGHIJKLMNOP")
+_REGPAIRS = frozenset(hi + lo for hi in _REGS for lo in _REGS)
+
 # =========================
 # Parser
 # =========================
 class Parser:
-    def __init__(self, tokens: List[Token]):
-        self.toks = tokens
-        self.i = 0
-
-    def peek(self, k: int = 0) -> Optional[Token]:
-        j = self.i + k
-        return self.toks[j] if 0 <= j < len(self.toks) else None
+    def __init__(self, tokens: Iterable[Token]):
+        # tokens are pulled lazily; only the lookahead window is kept in memory.
+        # The stream must end with the EOF sentinel, as iter_tokens() produces.
+        self.stream = iter(tokens)
+        self.buf: Deque[Token] = deque()
+
+        # token kind -> handler for the keyword-led forms; everything else is handled inline
+        self.stmt_dispatch: Dict[str, Callable[[], Stmt]] = {
+            "LET": self.parse_let,
+            "IF": self.parse_if,
+            "WHILE": self.parse_while,
+            "OUT": self.parse_out_stmt,
+        }
+        # token kind -> handler(peeked token)
+        self.target_dispatch: Dict[str, Callable[[Token], Target]] = {
+            "REG": self.target_reg,
+            "MEM": self.target_mem,
+            "IDENT": self.target_var,
+        }
+        self.operand_dispatch: Dict[str, Callable[[Token], Operand]] = {
+            "CALL": self.operand_call,
+            "IN": self.operand_in,
+            "REG": self.operand_reg,
+            "MEM": self.operand_mem,
+            "CHARLIT": self.operand_char,
+            "BIN": self.operand_num,
+            "NUM": self.operand_num,
+            "IDENT": self.operand_var,
+        }
+
+    def peek(self, k: int = 0) -> Token:
+        buf = self.buf
+        while len(buf) <= k:
+            # EOF is never consumed, so past the end we just repeat it
+            t = next(self.stream, None)
+            buf.append(t if t is not None else buf[-1])
+        return buf[k]
 
     def accept(self, kind: str) -> Optional[Token]:
-        t = self.peek()
-        if t and t.kind == kind:
-            self.i += 1
+        # inline peek(): the current token is usually buffered already
+        buf = self.buf
+        t = buf[0] if buf else self.peek()
+        if t.kind == kind:
+            buf.popleft()
             return t
         return None
 
     def expect(self, kind: str) -> Token:
-        t = self.peek()
-        if not t or t.kind != kind:
-            got = t.kind if t else "EOF"
-            line = t.line if t else (self.toks[-1].line if self.toks else 1)
-            col = t.col if t else (self.toks[-1].col if self.toks else 1)
-            raise SyntaxError(f"Expected {kind}, got {got} at line {line}, col {col}")
-        self.i += 1
+        buf = self.buf
+        t = buf[0] if buf else self.peek()
+        if t.kind != kind:
+            self.raise_expected(kind, t)
+        buf.popleft()
         return t
 
+    def raise_expected(self, kind: str, t: Token) -> NoReturn:
+        # cold path of expect(), kept out of line
+        raise SyntaxError(f"Expected {kind}, got {t.kind} at line {t.line}, col {t.col}")
+
+    def advance(self) -> Token:
+        # only valid right after peek() has checked the current token
+        return self.buf.popleft()
+
+    def expect_reg_name(self) -> Tuple[Token, str]:
+        """
+        Consumes reg[X] / reg[XY] (REG LBRACK IDENT RBRACK) in one step.
+        Returns: (REG token, upper-cased register name).
+        """
+        buf = self.buf
+        if (
+            self.peek(3).kind == "RBRACK"
+            and buf[1].kind == "LBRACK"
+            and buf[2].kind == "IDENT"
+        ):
+            reg_tok = buf.popleft()
+            buf.popleft()
+            regname = buf.popleft().text_upper
+            buf.popleft()
+            return reg_tok, regname
+
+        # slow path: same tokens, but with proper error reporting
+        reg_tok = self.expect("REG")
+        self.expect("LBRACK")
+        regname = self.expect("IDENT").text_upper
+        self.expect("RBRACK")
+        return reg_tok, regname
+
     def parse_program(self) -> Program:
         funcs: List[FuncDef] = []
         main: List[Stmt] = []
-        while self.peek():
-            if self.peek().kind == "FUNC":
-                funcs.append(self.parse_funcdef())
+        # hot loop: keep bound methods in locals
+        peek = self.peek
+        parse_funcdef = self.parse_funcdef
+        parse_stmt = self.parse_stmt
+        funcs_append = funcs.append
+        main_append = main.append
+        while True:
+            kind = peek().kind
+            if kind == "EOF":
+                break
+            if kind == "FUNC":
+                funcs_append(parse_funcdef())
             else:
-                main.append(self.parse_stmt(allow_return=False))
+                main_append(parse_stmt(allow_return=False))
         return Program(funcs=funcs, main=main)
 
     def parse_funcdef(self) -> FuncDef:
@@ -212,25 +421,30 @@ class Parser:
         body: List[Stmt] = []
         ret_stmt: Optional[Stmt] = None
 
+        peek = self.peek
+        parse_stmt = self.parse_stmt
+        body_append = body.append
         while True:
-            if self.accept("RBRACE"):
+            t = peek()
+            if t.kind == "RBRACE":
+                self.advance()
                 break
-            if not self.peek():
+            if t.kind == "EOF":
                 raise SyntaxError(f"Unclosed function block for {name_tok.text}: missing '}}'")
 
             # return is mandatory, v1: single return
-            if self.peek().kind == "RETURN":
+            if t.kind == "RETURN":
                 if ret_stmt is not None:
-                    raise SyntaxError(f"Multiple return not allowed (v1) in function {name_tok.text} at line {self.peek().line}")
+                    raise SyntaxError(f"Multiple return not allowed (v1) in function {name_tok.text} at line {t.line}")
                 ret_stmt = self.parse_return_stmt()
                 # After return, we still allow only '}' (no more statements)
                 # But we won't hard-enforce here; we can allow empty lines/comments already removed.
                 continue
 
             if ret_stmt is not None:
-                raise SyntaxError(f"Statements after return are not allowed in function {name_tok.text} (line {self.peek().line})")
+                raise SyntaxError(f"Statements after return are not allowed in function {name_tok.text} (line {t.line})")
 
-            body.append(self.parse_stmt(allow_return=False))
+            body_append(parse_stmt(allow_return=False))
 
         if ret_stmt is None:
             raise SyntaxError(f"Function {name_tok.text} must have return (line {f_tok.line})")
@@ -240,34 +454,34 @@ class Parser:
     def parse_block(self) -> List[Stmt]:
         self.expect("LBRACE")
         stmts: List[Stmt] = []
+        peek = self.peek
+        parse_stmt = self.parse_stmt
+        stmts_append = stmts.append
         while True:
-            if self.accept("RBRACE"):
+            kind = peek().kind
+            if kind == "RBRACE":
+                self.advance()
                 break
-            if not self.peek():
+            if kind == "EOF":
                 raise SyntaxError("Unclosed block: missing '}'")
-            stmts.append(self.parse_stmt(allow_return=False))
+            stmts_append(parse_stmt(allow_return=False))
         return stmts
 
     def parse_stmt(self, allow_return: bool) -> Stmt:
         t = self.peek()
-        if not t:
+        if t.kind == "EOF":
             raise SyntaxError("Unexpected EOF")
 
-        if t.kind == "LET":
-            return self.parse_let()
-        if t.kind == "IF":
-            return self.parse_if()
-        if t.kind == "WHILE":
-            return self.parse_while()
-        if t.kind == "OUT":
-            return self.parse_out_stmt()
+        handler = self.stmt_dispatch.get(t.kind)
+        if handler is not None:
+            return handler()
         if t.kind == "RETURN":
             if not allow_return:
                 raise SyntaxError(f"'return' not allowed here (line {t.line})")
             return self.parse_return_stmt()
         if t.kind == "HALT":
-            ht = self.expect("HALT")
-            return Stmt("halt", None, ht.line)
+            self.advance()
+            return Stmt("halt", None, t.line)
 
         return self.parse_assignment_like()
 
@@ -294,7 +508,7 @@ class Parser:
         else_block = None
         if self.accept("ELSE"):
             else_block = self.parse_block()
-        return Stmt("if", {"cond": cond, "then": then_block, "else": else_block}, if_tok.line)
+        return Stmt("if", IfData(cond, then_block, else_block), if_tok.line)
 
     def parse_while(self) -> Stmt:
         w_tok = self.expect("WHILE")
@@ -302,7 +516,7 @@ class Parser:
         cond = self.parse_condition()
         self.expect("RPAREN")
         body = self.parse_block()
-        return Stmt("while", {"cond": cond, "body": body}, w_tok.line)
+        return Stmt("while", WhileData(cond, body), w_tok.line)
 
     def parse_out_stmt(self) -> Stmt:
         out_tok = self.expect("OUT")
@@ -311,85 +525,86 @@ class Parser:
         self.expect("COMMA")
         val = self.parse_operand()
         self.expect("RPAREN")
-        return Stmt("out", {"port": port, "val": val}, out_tok.line)
+        return Stmt("out", OutData(port, val), out_tok.line)
 
     def parse_assignment_like(self) -> Stmt:
         target = self.parse_target()
 
-        nxt = self.peek()
-        if nxt and nxt.kind == "OP" and nxt.text in ("++", "--"):
-            op = self.expect("OP").text
-            return Stmt("postfix", {"target": target, "op": op}, target.line)
-
-        op_tok = self.expect("OP")
+        # one peek serves both the postfix check and the operator itself
+        op_tok = self.peek()
+        if op_tok.kind != "OP":
+            self.raise_expected("OP", op_tok)
+        self.advance()
         op = op_tok.text
+        op_kind = op_tok.op_kind
+
+        if op_kind == "postfix":
+            return Stmt("postfix", PostfixData(target, op), target.line)
 
-        if op == "=":
-            if self.peek() and self.peek().kind == "NOT":
-                self.expect("NOT")
+        if op_kind == "assign":
+            if self.accept("NOT"):
                 rhs = self.parse_operand()
-                return Stmt("assign_not", {"target": target, "rhs": rhs}, op_tok.line)
+                return Stmt("assign_not", AssignData(target, rhs), op_tok.line)
             rhs = self.parse_operand()
-            return Stmt("assign", {"target": target, "rhs": rhs}, op_tok.line)
+            return Stmt("assign", AssignData(target, rhs), op_tok.line)
 
-        if op in ("+=", "-=", "&=", "|=", "^=", "<<=", ">>="):
+        if op_kind == "compound":
             rhs = self.parse_operand()
-            return Stmt("opassign", {"target": target, "op": op, "rhs": rhs}, op_tok.line)
+            return Stmt("opassign", OpAssignData(target, op, rhs), op_tok.line)
 
         raise SyntaxError(f"Unsupported operator {op} at line {op_tok.line}")
 
-    def parse_condition(self) -> Dict[str, Any]:
+    def parse_condition(self) -> Cond:
         left = self.parse_operand()
         op_tok = self.expect("OP")
-        if op_tok.text not in ("==", "!=", "<", ">", "<=", ">="):
+        if op_tok.op_kind != "cmp":
             raise SyntaxError(f"Invalid condition operator {op_tok.text} at line {op_tok.line}")
         right = self.parse_operand()
-        return {"left": left, "op": op_tok.text, "right": right, "line": op_tok.line}
+        return Cond(left, op_tok.text, right, op_tok.line)
 
     def parse_target(self) -> Target:
         t = self.peek()
-        if not t:
+        handler = self.target_dispatch.get(t.kind)
+        if handler is not None:
+            return handler(t)
+        if t.kind == "EOF":
             raise SyntaxError("Unexpected EOF in target")
+        raise SyntaxError(f"Invalid target at line {t.line}")
 
-        if t.kind == "REG":
-            reg_tok = self.expect("REG")
-            self.expect("LBRACK")
-            regname = self.expect("IDENT").text.upper()
-            self.expect("RBRACK")
-            if len(regname) == 1:
-                return Target("reg", regname, reg_tok.line)
-            elif len(regname) == 2:
-                return Target("regpair", regname, reg_tok.line)
-            else:
-                raise SyntaxError(f"Invalid reg name {regname} at line {reg_tok.line}")
+    def target_reg(self, t: Token) -> Target:
+        reg_tok, regname = self.expect_reg_name()
+        if len(regname) == 1:
+            return Target("reg", regname, reg_tok.line)
+        elif len(regname) == 2:
+            return Target("regpair", regname, reg_tok.line)
+        else:
+            raise SyntaxError(f"Invalid reg name {regname} at line {reg_tok.line}")
 
-        if t.kind == "MEM":
-            mem_tok = self.expect("MEM")
-            self.expect("LBRACK")
-            addr = self.parse_address()
-            self.expect("RBRACK")
-            return Target("mem", addr, mem_tok.line)
+    def target_mem(self, t: Token) -> Target:
+        self.advance()
+        self.expect("LBRACK")
+        addr = self.parse_address()
+        self.expect("RBRACK")
+        return Target("mem", addr, t.line)
 
-        if t.kind == "IDENT":
-            tok = self.expect("IDENT")
-            return Target("var", tok.text, tok.line)
-
-        raise SyntaxError(f"Invalid target at line {t.line}")
+    def target_var(self, t: Token) -> Target:
+        self.advance()
+        return Target("var", t.text, t.line)
 
     def parse_address(self) -> Operand:
         t = self.peek()
-        if not t:
+        if t.kind == "EOF":
             raise SyntaxError("Unexpected EOF in address")
 
         if t.kind in ("NUM", "BIN"):
             return self.parse_operand()
 
         if t.kind == "IDENT":
-            tok = self.expect("IDENT")
-            name = tok.text.upper()
-            if len(name) == 2 and all(ch in "ABCDEFGHIJKLMNOP" for ch in name):
-                return Operand("regpair", name, tok.line)
-            return Operand("var", tok.text, tok.line)
+            self.advance()
+            name = t.text_upper
+            if name in _REGPAIRS:
+                return Operand("regpair", name, t.line)
+            return Operand("var", t.text, t.line)
 
         if t.kind == "REG":
             raise SyntaxError(f"Use mem[GH] not mem[reg[GH]] at line {t.line}")
@@ -398,120 +613,464 @@ class Parser:
 
     def parse_operand(self) -> Operand:
         t = self.peek()
-        if not t:
+        handler = self.operand_dispatch.get(t.kind)
+        if handler is not None:
+            return handler(t)
+        if t.kind == "EOF":
             raise SyntaxError("Unexpected EOF in operand")
+        raise SyntaxError(f"Invalid operand at line {t.line}")
 
-        # call foo(...)
-        if t.kind == "CALL":
-            call_tok = self.expect("CALL")
-            fname = self.expect("IDENT").text
-            self.expect("LPAREN")
-            args: List[Operand] = []
-            if not self.accept("RPAREN"):
-                while True:
-                    args.append(self.parse_operand())
-                    if self.accept("COMMA"):
-                        continue
-                    self.expect("RPAREN")
-                    break
-            return Operand("call", {"name": fname, "args": args}, call_tok.line)
-
-        # in(...)
-        if t.kind == "IN":
-            in_tok = self.expect("IN")
-            self.expect("LPAREN")
-            port = self.parse_operand()
-            self.expect("RPAREN")
-            return Operand("in", port, in_tok.line)
-
-        # reg[...]
-        if t.kind == "REG":
-            reg_tok = self.expect("REG")
-            self.expect("LBRACK")
-            regname = self.expect("IDENT").text.upper()
-            self.expect("RBRACK")
-            if len(regname) == 1:
-                return Operand("reg", regname, reg_tok.line)
-            elif len(regname) == 2:
-                return Operand("regpair", regname, reg_tok.line)
-            else:
-                raise SyntaxError(f"Invalid reg name {regname} at line {reg_tok.line}")
+    # call foo(...)
+    def operand_call(self, t: Token) -> Operand:
+        self.advance()
+        fname = self.expect("IDENT").text
+        self.expect("LPAREN")
+        args: List[Operand] = []
+        if not self.accept("RPAREN"):
+            while True:
+                args.append(self.parse_operand())
+                if self.accept("COMMA"):
+                    continue
+                self.expect("RPAREN")
+                break
+        return Operand("call", CallData(fname, args), t.line)
 
-        # mem[...]
-        if t.kind == "MEM":
-            mem_tok = self.expect("MEM")
-            self.expect("LBRACK")
-            addr = self.parse_address()
-            self.expect("RBRACK")
-            return Operand("mem", addr, mem_tok.line)
+    # in(...)
+    def operand_in(self, t: Token) -> Operand:
+        self.advance()
+        self.expect("LPAREN")
+        port = self.parse_operand()
+        self.expect("RPAREN")
+        return Operand("in", port, t.line)
+
+    # reg[...]
+    def operand_reg(self, t: Token) -> Operand:
+        reg_tok, regname = self.expect_reg_name()
+        if len(regname) == 1:
+            return Operand("reg", regname, reg_tok.line)
+        elif len(regname) == 2:
+            return Operand("regpair", regname, reg_tok.line)
+        else:
+            raise SyntaxError(f"Invalid reg name {regname} at line {reg_tok.line}")
+
+    # mem[...]
+    def operand_mem(self, t: Token) -> Operand:
+        self.advance()
+        self.expect("LBRACK")
+        addr = self.parse_address()
+        self.expect("RBRACK")
+        return Operand("mem", addr, t.line)
+
+    def operand_char(self, t: Token) -> Operand:
+        # a char literal is just its code from here on (all codes fit in u8)
+        self.advance()
+        return SMALL_INT_OPERANDS[char_code(t.text[1], t.line)]
+
+    def operand_num(self, t: Token) -> Operand:
+        # NUM and BIN: the tokenizer already converted the text
+        self.advance()
+        v = t.value
+        return SMALL_INT_OPERANDS.get(v) or Operand("num", v, t.line)
+
+    def operand_var(self, t: Token) -> Operand:
+        self.advance()
+        return Operand("var", t.text, t.line)
 
-        if t.kind == "CHARLIT":
-            tok = self.expect("CHARLIT")
-            ch = tok.text[1]
-            return Operand("char", ch, tok.line)
+# =========================
+# Codegen
+# =========================
+START_LABEL = "__start"
+
+# fixed parts of the rendered listing (see Codegen.render)
+RENDER_HEAD = (
+    "; ===== GENERATED ASM (HighLang -> ASM) =====",
+    "",
+    f"JMP {START_LABEL}",
+    "",
+    "; ===== FUNCTIONS =====",
+)
+RENDER_MAIN = ("", "; ===== MAIN =====", f"{START_LABEL}:")
+RENDER_DATA = ("", "HALT", "", "; ===== DATA =====", "")
+
+# op -> (compare, jump to the false label); A = left, B = right
+_U8_COND_FALSE: Dict[str, Tuple[str, str]] = {
+    "==": ("CMP A, B", "JNZ %s"),
+    "!=": ("CMP A, B", "JZ %s"),
+    "<": ("CMP A, B", "JNC %s"),
+    ">=": ("CMP A, B", "JC %s"),
+    # a > b is b < a: compare the other way round so one carry test decides
+    ">": ("CMP B, A", "JNC %s"),
+    "<=": ("CMP B, A", "JC %s"),
+}
 
-        if t.kind == "BIN":
-            tok = self.expect("BIN")
-            return Operand("num", int(tok.text[2:], 2), tok.line)
+# op -> (templates, needs eq_hi label, needs cont label); A:C = left, B:D = right
+_U16_COND_FALSE: Dict[str, Tuple[Tuple[str, ...], bool, bool]] = {
+    # equality tests the LO bytes first: they are the likelier pair to differ
+    "==": (("CMP C, D", "JNZ %(false)s", "CMP A, B", "JNZ %(false)s"), False, False),
+    "!=": (("CMP C, D", "JNZ %(cont)s", "CMP A, B", "JNZ %(cont)s",
+            "JMP %(false)s", "%(cont)s:"), False, True),
+    "<":  (("CMP A, B", "JC %(cont)s", "JZ %(eq_hi)s", "JMP %(false)s", "%(eq_hi)s:",
+            "CMP C, D", "JNC %(false)s", "%(cont)s:"), True, True),
+    ">=": (("CMP A, B", "JC %(false)s", "JZ %(eq_hi)s", "JMP %(cont)s", "%(eq_hi)s:",
+            "CMP C, D", "JC %(false)s", "%(cont)s:"), True, True),
+    ">":  (("CMP A, B", "JC %(false)s", "JZ %(eq_hi)s", "JMP %(cont)s", "%(eq_hi)s:",
+            "CMP C, D", "JC %(false)s", "JZ %(false)s", "%(cont)s:"), True, True),
+    "<=": (("CMP A, B", "JC %(cont)s", "JZ %(eq_hi)s", "JMP %(false)s", "%(eq_hi)s:",
+            "CMP C, D", "JC %(cont)s", "JZ %(cont)s", "JMP %(false)s", "%(cont)s:"), True, True),
+}
+# u16 `left op 0`, left in A:C: one OR gives Z = (left == 0);
+# None means the condition is constant (never true for <, always true for >=)
+_U16_ZERO_COND_FALSE: Dict[str, Optional[Tuple[str, ...]]] = {
+    "==": ("OR A, C", "JNZ %s"),
+    "<=": ("OR A, C", "JNZ %s"),
+    "!=": ("OR A, C", "JZ %s"),
+    ">":  ("OR A, C", "JZ %s"),
+    "<":  None,
+    ">=": None,
+}
 
-        if t.kind == "NUM":
-            tok = self.expect("NUM")
-            return Operand("num", int(tok.text, 10), tok.line)
+# instruction templates for the hot emitters ('%' is cheaper than an f-string here)
+_FMT_LDI = "LDI %s, %d"
+_FMT_MOV = "MOV %s, %s"
+_FMT_LDM = "LDM %s, %s"
+_FMT_STM = "STM %s, %s"
+_FMT_LDR = "LDR %s, %s, %s"
+_FMT_STR = "STR %s, %s, %s"
+_FMT_IN = "IN %s, %d"
+_FMT_JMP = "JMP %s"
+_FMT_LABEL = "%s:"
+_FMT_OP2 = "%s %s, %s"      # ALU op dst, src
+_FMT_OP1 = "%s %s"          # INC/DEC/SHL/SHR r
+_FMT_STEP16 = "%s16 %s, %s"  # INC16/DEC16 lo, hi (assembler pseudo-instructions)
+_FMT_LDI16 = "LDI16 %s, %d"
+_FMT_OUT = "OUT %d, %s"
+_FMT_CALL = "CALL %s"
+
+# instructions that leave every register and every labelled memory cell alone
+# (STM is checked by label, STR and numeric STM may alias anything). Jumps are included: the
+# fall-through path keeps G:H, and the code they reach starts at a label.
+_GH_KEEP = frozenset(("CMP", "OUT", "PUSH", "PUSH16", "JMP", "JZ", "JNZ", "JC", "JNC", "HALT"))
+# instructions whose only register write is their first operand
+_WRITES_FIRST = frozenset((
+    "LDI", "LDM", "MOV", "IN", "LDR", "ADD", "ADC", "SUB", "SBC",
+    "AND", "OR", "XOR", "INC", "DEC", "NOT", "SHL", "SHR", "POP",
+))
+# instructions that write no register (jumps keep the fall-through path's values)
+_WRITES_NONE = frozenset((
+    "STM", "STR", "OUT", "CMP", "PUSH", "PUSH16", "JMP", "JZ", "JNZ", "JC", "JNC", "HALT",
+))
+# u8 op-assign -> ALU instruction (shifts are expanded to SHL/SHR runs instead)
+_OP_ASSIGN_TO_ASM = {"+=": "ADD", "-=": "SUB", "&=": "AND", "|=": "OR", "^=": "XOR"}
+# compile-time versions of the u8 op-assign instructions
+_FOLD_U8 = {
+    "+=": lambda a, b: (a + b) & 0xFF,
+    "-=": lambda a, b: (a - b) & 0xFF,
+    "&=": lambda a, b: a & b,
+    "|=": lambda a, b: a | b,
+    "^=": lambda a, b: a ^ b,
+    "<<=": lambda a, b: (a << b) & 0xFF,
+    ">>=": lambda a, b: a >> b,
+}
 
-        if t.kind == "IDENT":
-            tok = self.expect("IDENT")
-            return Operand("var", tok.text, tok.line)
+def strength_reduce_u8(op: str, k: int) -> Optional[Tuple[Optional[str], int]]:
+    """Cheaper form of u8 `x op= k` for a constant k, as (instruction, repeat count).
+
+    (None, 0) means x is unchanged, ("LDI", 0) means x becomes 0, None means
+    no cheaper form (use LDI tmp + op). Shift amounts arrive clamped to 0..8.
+    """
+    if op == "<<=" or op == ">>=":
+        if k == 0:
+            return None, 0
+        if k >= 8:
+            return "LDI", 0
+        return ("SHL" if op == "<<=" else "SHR"), k
+    if op == "+=" or op == "-=":
+        if op == "-=":
+            k = -k & 0xFF
+        if k == 0:
+            return None, 0
+        if k <= 2:
+            return "INC", k
+        if k >= 0xFE:
+            return "DEC", 0x100 - k
+        return None
+    if op == "&=":
+        if k == 0xFF:
+            return None, 0
+        if k == 0:
+            return "LDI", 0
+        return None
+    if k == 0:  # |= 0, ^= 0
+        return None, 0
+    return None
+
+def peephole(lines: List[str]) -> List[str]:
+    """Clean up straight-line emitter output (a label or jump in between stops every rule).
+
+    - MOV X, X                          -> dropped
+    - STM lbl, R ; LDM R, lbl           -> STM lbl, R
+    - STM lbl, R ; LDM Q, lbl           -> STM lbl, R ; MOV Q, R
+    - LDM R, lbl ; STM lbl, R           -> LDM R, lbl
+    - STM lbl, R ; STM lbl, Q           -> STM lbl, Q
+    - the same LDM lbl/LDI/MOV twice    -> once
+    - LDI R, j ; LDI R, k               -> LDI R, k
+    - JMP/HALT/RET ; ... ; lbl:         -> JMP/HALT/RET ; lbl:  (labels are the only entry points)
+    - JMP lbl ; lbl:                    -> lbl:
+    Only labelled addresses are touched (a numeric one may be an I/O cell). None of
+    MOV/LDM/STM changes flags, so the rewrites are always safe.
+    """
+    out: List[str] = []
+    append = out.append
+    prev = ""
+    dead = False  # after an unconditional transfer, until the next label
+    for ln in lines:
+        if ln[-1:] == ":":
+            dead = False
+            if prev == _FMT_JMP % ln[:-1]:
+                out.pop()
+        elif dead:
+            continue
+        head = ln[:4]
+        if ln == prev and (head == "LDI " or head == "MOV "
+                           or (head == "LDM " and not ln.partition(", ")[2][:1].isdigit())):
+            continue
+        if head == "MOV ":
+            dst, _, src = ln[4:].partition(", ")
+            if dst == src:
+                continue
+        elif head == "LDI " and prev[:4] == "LDI ":
+            if prev.partition(",")[0] == ln.partition(",")[0]:
+                out[-1] = prev = ln
+                continue
+        elif head == "LDM " and prev[:4] == "STM ":
+            reg, _, addr = ln[4:].partition(", ")
+            paddr, _, preg = prev[4:].partition(", ")
+            if addr == paddr and not addr[:1].isdigit():
+                if reg == preg:
+                    continue
+                ln = _FMT_MOV % (reg, preg)
+        elif head == "STM " and not ln[4:5].isdigit():
+            addr, _, reg = ln[4:].partition(", ")
+            if prev[:4] == "LDM " and prev == _FMT_LDM % (reg, addr):
+                continue
+            if prev[:4] == "STM " and prev.startswith(addr + ", ", 4):
+                out[-1] = ln
+                prev = ln
+                continue
+        elif head == "JMP " or ln == "HALT" or ln == "RET":
+            dead = True
+        append(ln)
+        prev = ln
+    return out
 
-        raise SyntaxError(f"Invalid operand at line {t.line}")
+_JUMP_OPS = frozenset(("JMP", "JZ", "JNZ", "JC", "JNC"))
+
+def thread_jumps(lines: List[str]) -> List[str]:
+    """Retarget jumps to a label whose only code is `JMP T` straight at T.
+
+    Chains resolve transitively (a self-loop stays put). Labels are kept, so
+    fall-through into them still works; peephole() cleans up what this exposes.
+    """
+    fwd: Dict[str, str] = {}
+    pending: List[str] = []  # labels seen since the last instruction
+    for ln in lines:
+        if ln[-1:] == ":":
+            pending.append(ln[:-1])
+            continue
+        if pending:
+            if ln[:4] == "JMP ":
+                for lbl in pending:
+                    fwd[lbl] = ln[4:]
+            pending = []
+    if not fwd:
+        return lines
+
+    final: Dict[str, str] = {}
+    for lbl in fwd:
+        seen = {lbl}
+        t = fwd[lbl]
+        while t in fwd and t not in seen:
+            seen.add(t)
+            t = fwd[t]
+        final[lbl] = t
+
+    out: List[str] = []
+    append = out.append
+    for ln in lines:
+        op, _, t = ln.partition(" ")
+        if op in _JUMP_OPS and t in final:
+            ln = "%s %s" % (op, final[t])
+        append(ln)
+    return out
+
+def render_data(decls: List[Tuple[str, int]]) -> Iterator[str]:
+    # u16 cells are split into <base>_lo / <base>_hi bytes, matching varlabels_u16
+    for base, size in decls:
+        if size == 1:
+            yield f"{base}: $ 0"
+        else:
+            yield f"{base}_lo: $ 0"
+            yield f"{base}_hi: $ 0"
+
+@dataclass(slots=True)
+class VarInfo:
+    vtype: str
+    # (byte,) for u8/char, (lo, hi) for u16
+    labels: Tuple[str, ...]
 
-# =========================
-# Codegen
-# =========================
 class Codegen:
-    def __init__(self):
-        # stacked scopes: each scope maps source var name -> varinfo dict
-        self.scopes: List[Dict[str, Dict[str, Any]]] = [dict()]  # global scope
+    def __init__(self) -> None:
+        # flattened scopes: source var name -> stack of VarInfo (top = visible binding),
+        # plus the names each open scope declared, to unwind them on pop_scope
+        self.vars: Dict[str, List[VarInfo]] = {}
+        self.scope_names: List[Set[str]] = [set()]  # global scope
+        # bumped on every scope change; invalidates Operand/Target.cache_info
+        self.scope_gen = 0
         self.current_func: Optional[str] = None
 
         self.main_asm: List[str] = []
         self.func_asm: List[str] = []
-        self.data: List[str] = []
-
-        self.lbl_id = 0
+        # (base label, size in bytes); formatted into the data section by render()
+        self.data: List[Tuple[str, int]] = []
+        # append/extend of the list emit() writes to; follows current_func
+        self._emit = self.main_asm.append
+        self._extend = self.main_asm.extend
+        # (lo, hi) labels of the u16 var whose value G:H currently holds, if any
+        self._gh_addr: Optional[Tuple[str, str]] = None
+        # register -> value it is known to hold at the current emit point
+        self.reg_const: Dict[str, int] = {}
+
+        # label prefix -> next free number; numbering per prefix keeps the labels short
+        self.lbl_ids: Dict[str, int] = {}
 
         # function table
         # name -> {params:[{name, type}], ret_width:8|16}
         self.funcs: Dict[str, Dict[str, Any]] = {}
 
+        # Stmt.kind -> handler(stmt)
+        self.stmt_dispatch: Dict[str, Callable[[Stmt], None]] = {
+            "let": self.stmt_let,
+            "assign": self.stmt_assign,
+            "halt": self.stmt_halt,
+            "assign_not": self.stmt_assign_not,
+            "opassign": self.stmt_opassign,
+            "postfix": self.stmt_postfix,
+            "out": self.stmt_out,
+            "if": self.stmt_if,
+            "while": self.stmt_while,
+        }
+        # Operand.kind -> handler(op, dst register) for u8 loads
+        self.load_u8_dispatch: Dict[str, Callable[[Operand, str], None]] = {
+            "num": self.load_u8_num,
+            "reg": self.load_u8_reg,
+            "var": self.load_u8_var,
+            "mem": self.load_u8_mem,
+            "in": self.load_u8_in,
+        }
+
     # ---------- utilities ----------
     def new_label(self, prefix: str) -> str:
-        s = f"{prefix}_{self.lbl_id}"
-        self.lbl_id += 1
-        return s
+        n = self.lbl_ids.get(prefix, 0)
+        self.lbl_ids[prefix] = n + 1
+        return "%s_%d" % (prefix, n)
+
+    def emit(self, line: str) -> None:
+        if self._gh_addr is not None:
+            self._track_gh(line)
+        if self.reg_const or line[:4] == "LDI ":
+            self._track_consts(line)
+        # formatted lines like "LDM A, i" repeat a lot; share one object per text
+        if len(line) < 20:
+            line = _intern(line)
+        self._emit(line)
+
+    def emit_ldi(self, r: str, k: int) -> None:
+        # LDI sets no flags, so a register already known to hold k needs no reload
+        if self.reg_const.get(r) != k:
+            self.emit(_FMT_LDI % (r, k))
+
+    def emit_many(self, lines: Iterable[str]) -> None:
+        # one list.extend for a fixed sequence; per-line emit only while G:H is cached
+        if self._gh_addr is not None:
+            for line in lines:
+                self.emit(line)
+            return
+        self._extend(lines)
+        # fixed sequences hold labels/calls: not worth tracking through
+        self.reg_const.clear()
+
+    def _track_consts(self, line: str) -> None:
+        head, _, rest = line.partition(" ")
+        if head in _WRITES_FIRST:
+            dst, _, src = rest.partition(", ")
+            if head == "LDI":
+                self.reg_const[dst] = int(src)
+            elif head == "MOV" and src in self.reg_const:
+                self.reg_const[dst] = self.reg_const[src]
+            else:
+                self.reg_const.pop(dst, None)
+        elif head not in _WRITES_NONE:
+            # labels (join points), CALL/RET, pair writes
+            self.reg_const.clear()
+
+    def _track_gh(self, line: str) -> None:
+        # drop the cached G:H address unless `line` provably keeps both G:H and the var intact
+        head, _, rest = line.partition(" ")
+        if head in _GH_KEEP:
+            return
+        if head == "STM":
+            # a numeric address may be the var's own cell, like STR
+            addr = rest.partition(",")[0]
+            if not addr[:1].isdigit() and addr not in self._gh_addr:
+                return
+        elif head in _WRITES_FIRST:
+            dst = rest.partition(",")[0]
+            if dst != "G" and dst != "H":
+                return
+        # labels, CALL/RET, STR, numeric STM, pair writes: forget
+        self._gh_addr = None
 
-    def emit(self, line: str):
-        if self.current_func is None:
-            self.main_asm.append(line)
-        else:
-            self.func_asm.append(line)
+    def load_gh_addr(self, addr: Operand) -> None:
+        # G:H = value of u16 var `addr`, reusing the previous load when still valid
+        lbls = self.varlabels_u16(addr)
+        if lbls == self._gh_addr:
+            return
+        self._gh_addr = None
+        self.emit(_FMT_LDM % ("H", lbls[0]))
+        self.emit(_FMT_LDM % ("G", lbls[1]))
+        self._gh_addr = lbls
 
-    def emit_data(self, line: str):
-        self.data.append(line)
+    def emit_data(self, base: str, size: int) -> None:
+        self.data.append((base, size))
 
     # ---------- scope ----------
-    def push_scope(self):
-        self.scopes.append(dict())
+    def push_scope(self) -> None:
+        self.scope_names.append(set())
+        self.scope_gen += 1
 
-    def pop_scope(self):
-        if len(self.scopes) <= 1:
+    def pop_scope(self) -> None:
+        if len(self.scope_names) <= 1:
             raise RuntimeError("Internal: pop global scope")
-        self.scopes.pop()
-
-    def lookup_var(self, name: str) -> Optional[Dict[str, Any]]:
-        for scope in reversed(self.scopes):
-            if name in scope:
-                return scope[name]
-        return None
+        for name in self.scope_names.pop():
+            stack = self.vars[name]
+            stack.pop()
+            if not stack:
+                del self.vars[name]
+        self.scope_gen += 1
+
+    def lookup_var(self, name: str) -> Optional[VarInfo]:
+        stack = self.vars.get(name)
+        return stack[-1] if stack else None
+
+    def lookup_var_for(self, ref: Union[Operand, Target]) -> Optional[VarInfo]:
+        # ref: Operand/Target of kind 'var'; repeated visits skip the scope walk
+        if ref.cache_gen == self.scope_gen:
+            return ref.cache_info
+        info = self.lookup_var(ref.value)
+        if info is not None:
+            ref.cache_gen = self.scope_gen
+            ref.cache_info = info
+        return info
 
     # ---------- values ----------
     def const_u8(self, n: int) -> int:
@@ -520,22 +1079,17 @@ class Codegen:
     def const_u16(self, n: int) -> int:
         return n & 0xFFFF
 
-    def char_code(self, ch: str, line: int) -> int:
-        if ch not in CHAR_TO_CODE:
-            raise ValueError(f"Unknown char {ch!r} at line {line} (not in CHAR_MAP)")
-        return CHAR_TO_CODE[ch]
-
-    def reg_ok(self, r: str):
-        if len(r) != 1 or r not in "ABCDEFGHIJKLMNOP":
+    def reg_ok(self, r: str) -> None:
+        if r not in _REGS:
             raise ValueError(f"Invalid register {r}")
 
-    def regpair_ok(self, rp: str):
-        if len(rp) != 2 or any(ch not in "ABCDEFGHIJKLMNOP" for ch in rp):
+    def regpair_ok(self, rp: str) -> None:
+        if rp not in _REGPAIRS:
             raise ValueError(f"Invalid register pair {rp}")
 
     # ---------- variable labels ----------
-    def declare_var(self, name: str, vtype: str, line: int):
-        if self.lookup_var(name) is not None and name in self.scopes[-1]:
+    def declare_var(self, name: str, vtype: str, line: int) -> None:
+        if name in self.scope_names[-1]:
             raise ValueError(f"Variable {name} redeclared in same scope at line {line}")
 
         if vtype not in ("u8", "u16", "char"):
@@ -548,115 +1102,114 @@ class Codegen:
             base = f"__{self.current_func}__{name}"
 
         if vtype in ("u8", "char"):
-            info = {"type": vtype, "labels": {"byte": base}}
-            self.emit_data(f"{base}: $ 0")
+            info = VarInfo(vtype, (base,))
+            self.emit_data(base, 1)
         else:
             lo = f"{base}_lo"
             hi = f"{base}_hi"
-            info = {"type": vtype, "labels": {"lo": lo, "hi": hi}}
-            self.emit_data(f"{lo}: $ 0")
-            self.emit_data(f"{hi}: $ 0")
+            info = VarInfo(vtype, (lo, hi))
+            self.emit_data(base, 2)
 
-        self.scopes[-1][name] = info
+        self.vars.setdefault(name, []).append(info)
+        self.scope_names[-1].add(name)
+        self.scope_gen += 1
 
-    def vartype(self, name: str, line: int) -> str:
-        info = self.lookup_var(name)
+    def var_info(self, ref: Union[Operand, Target]) -> VarInfo:
+        info = self.lookup_var_for(ref)
         if info is None:
-            raise ValueError(f"Unknown variable {name} at line {line}")
-        return info["type"]
+            raise ValueError(f"Unknown variable {ref.value} at line {ref.line}")
+        return info
+
+    def vartype(self, ref: Union[Operand, Target]) -> str:
+        return self.var_info(ref).vtype
 
-    def varlabel_u8(self, name: str, line: int) -> str:
-        t = self.vartype(name, line)
+    def varlabel_u8(self, ref: Union[Operand, Target]) -> str:
+        info = self.var_info(ref)
+        t = info.vtype
         if t not in ("u8", "char"):
-            raise ValueError(f"Variable {name} is {t}, expected u8/char at line {line}")
-        info = self.lookup_var(name)
-        return info["labels"]["byte"]
+            raise ValueError(f"Variable {ref.value} is {t}, expected u8/char at line {ref.line}")
+        return info.labels[0]
 
-    def varlabels_u16(self, name: str, line: int) -> Tuple[str, str]:
-        t = self.vartype(name, line)
+    def varlabels_u16(self, ref: Union[Operand, Target]) -> Tuple[str, str]:
+        info = self.var_info(ref)
+        t = info.vtype
         if t != "u16":
-            raise ValueError(f"Variable {name} is {t}, expected u16 at line {line}")
-        info = self.lookup_var(name)
-        return info["labels"]["lo"], info["labels"]["hi"]
+            raise ValueError(f"Variable {ref.value} is {t}, expected u16 at line {ref.line}")
+        return info.labels
 
     # ---------- type helpers ----------
+    def width_of(self, node: Union[Operand, Target]) -> int:
+        # returns 8 or 16; computed on first use and cached on the node
+        w = node.width
+        if w:
+            return w
+        kind = node.kind
+        if kind == "var":
+            w = 16 if self.vartype(node) == "u16" else 8
+        elif kind == "regpair":
+            w = 16
+        elif kind == "num":
+            w = 16 if int(node.value) > 0xFF else 8
+        else:
+            # reg, in, call, mem (memory is byte-addressed -> u8)
+            w = 8
+        node.width = w
+        return w
+
     def is_u16_operand(self, op: Operand) -> bool:
-        if op.kind == "var":
-            return self.vartype(op.value, op.line) == "u16"
-        if op.kind == "regpair":
-            return True
-        if op.kind == "num":
-            return int(op.value) > 0xFF
-        return False
+        return self.width_of(op) == 16
 
     def width_of_operand(self, op: Operand) -> int:
-        # returns 8 or 16
-        return 16 if self.is_u16_operand(op) else 8
+        return self.width_of(op)
 
     def width_of_target(self, target: Target) -> int:
-        if target.kind == "reg":
-            return 8
-        if target.kind == "regpair":
-            return 16
-        if target.kind == "var":
-            return 16 if self.vartype(target.value, target.line) == "u16" else 8
-        if target.kind == "mem":
-            # memory is byte-addressed here -> u8 store
-            return 8
-        raise ValueError(f"Unknown target kind {target.kind}")
+        if target.kind not in ("reg", "regpair", "var", "mem"):
+            raise ValueError(f"Unknown target kind {target.kind}")
+        return self.width_of(target)
 
     # ---------- load/store u8 ----------
-    def load_u8_into(self, op: Operand, dst: str, avoid: Optional[str] = None):
+    def load_u8_into(self, op: Operand, dst: str, avoid: Optional[str] = None) -> None:
         self.reg_ok(dst)
         if avoid and dst == avoid:
             raise ValueError("Internal: dst conflicts with avoid")
 
-        if op.kind == "num":
-            self.emit(f"LDI {dst}, {self.const_u8(op.value)}")
-            return
-
-        if op.kind == "char":
-            code = self.char_code(op.value, op.line)
-            self.emit(f"LDI {dst}, {code}")
-            return
+        handler = self.load_u8_dispatch.get(op.kind)
+        if handler is None:
+            raise ValueError(f"Unsupported operand for u8 load: {op.kind} at line {op.line}")
+        handler(op, dst)
 
-        if op.kind == "reg":
-            self.reg_ok(op.value)
-            if op.value != dst:
-                self.emit(f"MOV {dst}, {op.value}")
-            return
+    def load_u8_num(self, op: Operand, dst: str) -> None:
+        self.emit_ldi(dst, self.const_u8(op.value))
 
-        if op.kind == "var":
-            lbl = self.varlabel_u8(op.value, op.line)
-            self.emit(f"LDM {dst}, {lbl}")
-            return
+    def load_u8_reg(self, op: Operand, dst: str) -> None:
+        self.reg_ok(op.value)
+        if op.value != dst:
+            self.emit(_FMT_MOV % (dst, op.value))
 
-        if op.kind == "mem":
-            self.load_mem_u8_into(op.value, dst, op.line)
-            return
+    def load_u8_var(self, op: Operand, dst: str) -> None:
+        self.emit(_FMT_LDM % (dst, self.varlabel_u8(op)))
 
-        if op.kind == "in":
-            port = op.value
-            if port.kind == "num":
-                self.emit(f"IN {dst}, {port.value & 0xFF}")
-            else:
-                raise ValueError(f"in(port) requires constant port 0..7 at line {op.line}")
-            return
+    def load_u8_mem(self, op: Operand, dst: str) -> None:
+        self.load_mem_u8_into(op.value, dst, op.line)
 
-        raise ValueError(f"Unsupported operand for u8 load: {op.kind} at line {op.line}")
+    def load_u8_in(self, op: Operand, dst: str) -> None:
+        port = op.value
+        if port.kind != "num":
+            raise ValueError(f"in(port) requires constant port 0..7 at line {op.line}")
+        self.emit(_FMT_IN % (dst, port.value & 0xFF))
 
-    def store_u8_from(self, target: Target, src_reg: str):
+    def store_u8_from(self, target: Target, src_reg: str) -> None:
         self.reg_ok(src_reg)
 
         if target.kind == "reg":
             self.reg_ok(target.value)
             if target.value != src_reg:
-                self.emit(f"MOV {target.value}, {src_reg}")
+                self.emit(_FMT_MOV % (target.value, src_reg))
             return
 
         if target.kind == "var":
-            lbl = self.varlabel_u8(target.value, target.line)
-            self.emit(f"STM {lbl}, {src_reg}")
+            lbl = self.varlabel_u8(target)
+            self.emit(_FMT_STM % (lbl, src_reg))
             return
 
         if target.kind == "mem":
@@ -666,195 +1219,128 @@ class Codegen:
         raise ValueError(f"Unsupported u8 store target {target.kind} at line {target.line}")
 
     # ---------- memory helpers (byte) ----------
-    def load_mem_u8_into(self, addr: Operand, dst: str, line: int):
+    def load_mem_u8_into(self, addr: Operand, dst: str, line: int) -> None:
         self.reg_ok(dst)
         if addr.kind == "num":
-            self.emit(f"LDM {dst}, {self.const_u16(addr.value)}")
+            self.emit(_FMT_LDM % (dst, self.const_u16(addr.value)))
             return
         if addr.kind == "regpair":
             rp = addr.value
             self.regpair_ok(rp)
-            hi, lo = rp[0], rp[1]
-            self.emit(f"LDR {dst}, {hi}, {lo}")
+            self.emit(_FMT_LDR % (dst, rp[0], rp[1]))
             return
         if addr.kind == "var":
-            lo_lbl, hi_lbl = self.varlabels_u16(addr.value, addr.line)
-            self.emit(f"LDM H, {lo_lbl}")
-            self.emit(f"LDM G, {hi_lbl}")
-            self.emit(f"LDR {dst}, G, H")
+            self.load_gh_addr(addr)
+            self.emit(_FMT_LDR % (dst, "G", "H"))
             return
         raise ValueError(f"Invalid mem address kind {addr.kind} at line {line}")
 
-    def store_mem_u8_from(self, addr: Operand, src: str, line: int):
+    def store_mem_u8_from(self, addr: Operand, src: str, line: int) -> None:
         self.reg_ok(src)
         if addr.kind == "num":
-            self.emit(f"STM {self.const_u16(addr.value)}, {src}")
+            self.emit(_FMT_STM % (self.const_u16(addr.value), src))
             return
         if addr.kind == "regpair":
             rp = addr.value
             self.regpair_ok(rp)
-            hi, lo = rp[0], rp[1]
-            self.emit(f"STR {hi}, {lo}, {src}")
+            self.emit(_FMT_STR % (rp[0], rp[1], src))
             return
         if addr.kind == "var":
-            lo_lbl, hi_lbl = self.varlabels_u16(addr.value, addr.line)
-            self.emit(f"LDM H, {lo_lbl}")
-            self.emit(f"LDM G, {hi_lbl}")
-            self.emit(f"STR G, H, {src}")
+            self.load_gh_addr(addr)
+            self.emit(_FMT_STR % ("G", "H", src))
             return
         raise ValueError(f"Invalid mem address kind {addr.kind} at line {line}")
 
     # ---------- u16 load ----------
-    def load_u16_into(self, op: Operand, hi_reg: str, lo_reg: str):
+    def load_u16_into(self, op: Operand, hi_reg: str, lo_reg: str) -> None:
         self.reg_ok(hi_reg)
         self.reg_ok(lo_reg)
 
         if op.kind == "var":
-            lo_lbl, hi_lbl = self.varlabels_u16(op.value, op.line)
-            self.emit(f"LDM {lo_reg}, {lo_lbl}")
-            self.emit(f"LDM {hi_reg}, {hi_lbl}")
+            lo_lbl, hi_lbl = self.varlabels_u16(op)
+            self.emit(_FMT_LDM % (lo_reg, lo_lbl))
+            self.emit(_FMT_LDM % (hi_reg, hi_lbl))
             return
 
         if op.kind == "num":
             v = self.const_u16(op.value)
-            lo = v & 0xFF
-            hi = (v >> 8) & 0xFF
-            self.emit(f"LDI {lo_reg}, {lo}")
-            self.emit(f"LDI {hi_reg}, {hi}")
+            self.emit_ldi(lo_reg, v & 0xFF)
+            self.emit_ldi(hi_reg, (v >> 8) & 0xFF)
             return
 
         if op.kind == "regpair":
             rp = op.value
             self.regpair_ok(rp)
             if rp[0] != hi_reg:
-                self.emit(f"MOV {hi_reg}, {rp[0]}")
+                self.emit(_FMT_MOV % (hi_reg, rp[0]))
             if rp[1] != lo_reg:
-                self.emit(f"MOV {lo_reg}, {rp[1]}")
+                self.emit(_FMT_MOV % (lo_reg, rp[1]))
             return
 
         raise ValueError(f"Unsupported u16 operand {op.kind} at line {op.line}")
 
     # ---------- compare + jump false ----------
-    def emit_cond_jump_false(self, cond: Dict[str, Any], false_label: str):
-        left: Operand = cond["left"]
-        right: Operand = cond["right"]
-        op = cond["op"]
-        line = cond["line"]
+    def emit_cond_jump_false(self, cond: Cond, false_label: str) -> None:
+        left = cond.left
+        right = cond.right
+        op = cond.op
+        line = cond.line
 
         if self.is_u16_operand(left) or self.is_u16_operand(right):
             allowed = ("var", "num", "regpair")
             if left.kind not in allowed or right.kind not in allowed:
                 raise ValueError(f"u16 condition supports only u16 vars/regpairs/consts (line {line})")
 
-            if left.kind == "var" and self.vartype(left.value, left.line) != "u16":
+            if left.kind == "var" and self.width_of(left) != 16:
                 raise ValueError(f"Left operand must be u16 for u16 compare (line {line})")
-            if right.kind == "var" and self.vartype(right.value, right.line) != "u16":
+            if right.kind == "var" and self.width_of(right) != 16:
                 raise ValueError(f"Right operand must be u16 for u16 compare (line {line})")
 
             self.emit_cond_jump_false_u16(cond, false_label)
             return
 
-        self.load_u8_into(left, "A")
-        self.load_u8_into(right, "B", avoid="A")
-        self.emit("CMP A, B")
-
-        if op == "==":
-            self.emit(f"JNZ {false_label}")
-        elif op == "!=":
-            self.emit(f"JZ {false_label}")
-        elif op == "<":
-            self.emit(f"JNC {false_label}")
-        elif op == ">=":
-            self.emit(f"JC {false_label}")
-        elif op == ">":
-            self.emit(f"JC {false_label}")
-            self.emit(f"JZ {false_label}")
-        elif op == "<=":
-            true_label = self.new_label("cond_true")
-            self.emit(f"JC {true_label}")
-            self.emit(f"JZ {true_label}")
-            self.emit(f"JMP {false_label}")
-            self.emit(f"{true_label}:")
-        else:
+        entry = _U8_COND_FALSE.get(op)
+        if entry is None:
             raise ValueError(f"Unsupported condition operator {op} at line {line}")
+        cmp, jump = entry
 
-    def emit_cond_jump_false_u16(self, cond: dict, false_label: str):
-        left: Operand = cond["left"]
-        right: Operand = cond["right"]
-        op = cond["op"]
-        line = cond["line"]
+        self.load_u8_into(left, "A")
+        self.load_u8_into(right, "B", avoid="A")
+        self.emit(cmp)
+        self.emit(jump % false_label)
+
+    def emit_cond_jump_false_u16(self, cond: Cond, false_label: str) -> None:
+        left = cond.left
+        right = cond.right
+        op = cond.op
+        line = cond.line
+
+        if right.kind == "num" and self.const_u16(right.value) == 0 and op in _U16_ZERO_COND_FALSE:
+            tmpl = _U16_ZERO_COND_FALSE[op]
+            if tmpl is None:
+                if op == "<":
+                    self.emit(_FMT_JMP % false_label)
+                return
+            self.load_u16_into(left, hi_reg="A", lo_reg="C")
+            self.emit(tmpl[0])
+            self.emit(tmpl[1] % false_label)
+            return
 
         # A=Left_HI, C=Left_LO, B=Right_HI, D=Right_LO
         self.load_u16_into(left, hi_reg="A", lo_reg="C")
         self.load_u16_into(right, hi_reg="B", lo_reg="D")
 
-        eq_hi = self.new_label("u16_eq_hi")
-        cont = self.new_label("u16_true")
-
-        if op == "==":
-            self.emit("CMP A, B")
-            self.emit(f"JNZ {false_label}")
-            self.emit("CMP C, D")
-            self.emit(f"JNZ {false_label}")
-            return
-
-        if op == "!=":
-            self.emit("CMP A, B")
-            self.emit(f"JNZ {cont}")
-            self.emit("CMP C, D")
-            self.emit(f"JNZ {cont}")
-            self.emit(f"JMP {false_label}")
-            self.emit(f"{cont}:")
-            return
-
-        if op == "<":
-            self.emit("CMP A, B")
-            self.emit(f"JC {cont}")
-            self.emit(f"JZ {eq_hi}")
-            self.emit(f"JMP {false_label}")
-            self.emit(f"{eq_hi}:")
-            self.emit("CMP C, D")
-            self.emit(f"JNC {false_label}")
-            self.emit(f"{cont}:")
-            return
-
-        if op == ">=":
-            self.emit("CMP A, B")
-            self.emit(f"JC {false_label}")
-            self.emit(f"JZ {eq_hi}")
-            self.emit(f"JMP {cont}")
-            self.emit(f"{eq_hi}:")
-            self.emit("CMP C, D")
-            self.emit(f"JC {false_label}")
-            self.emit(f"{cont}:")
-            return
-
-        if op == ">":
-            self.emit("CMP A, B")
-            self.emit(f"JC {false_label}")
-            self.emit(f"JZ {eq_hi}")
-            self.emit(f"JMP {cont}")
-            self.emit(f"{eq_hi}:")
-            self.emit("CMP C, D")
-            self.emit(f"JC {false_label}")
-            self.emit(f"JZ {false_label}")
-            self.emit(f"{cont}:")
-            return
+        entry = _U16_COND_FALSE.get(op)
+        if entry is None:
+            raise ValueError(f"Unsupported u16 condition operator {op} at line {line}")
+        tmpl, need_eq, need_cont = entry
 
-        if op == "<=":
-            self.emit("CMP A, B")
-            self.emit(f"JC {cont}")
-            self.emit(f"JZ {eq_hi}")
-            self.emit(f"JMP {false_label}")
-            self.emit(f"{eq_hi}:")
-            self.emit("CMP C, D")
-            self.emit(f"JC {cont}")
-            self.emit(f"JZ {cont}")
-            self.emit(f"JMP {false_label}")
-            self.emit(f"{cont}:")
-            return
-
-        raise ValueError(f"Unsupported u16 condition operator {op} at line {line}")
+        labels = {"false": false_label}
+        if need_eq:
+            labels["eq_hi"] = self.new_label("u16_eq_hi")
+        if need_cont:
+            labels["cont"] = self.new_label("u16_true")
+        self.emit_many([t % labels for t in tmpl])
 
     # ---------- arithmetic/logic ----------
     def choose_temp(self, avoid: str) -> str:
@@ -872,42 +1358,56 @@ class Codegen:
             return Operand("mem", target.value, target.line)
         raise ValueError(f"Cannot treat target {target.kind} as operand")
 
-    def apply_opassign_u8(self, target: Target, op: str, rhs: Operand):
+    def apply_opassign_u8(self, target: Target, op: str, rhs: Operand) -> None:
         if op in ("<<=", ">>="):
             if rhs.kind != "num":
                 raise ValueError(f"Shift amount must be constant number at line {rhs.line}")
-            amt = max(0, int(rhs.value))
-            instr = "SHL" if op == "<<=" else "SHR"
-
-            if target.kind == "reg":
-                r = target.value
-                self.reg_ok(r)
-                for _ in range(amt):
-                    self.emit(f"{instr} {r}")
-                return
-
-            self.load_u8_into(self.target_as_operand(target), "A")
-            for _ in range(amt):
-                self.emit(f"{instr} A")
-            self.store_u8_from(target, "A")
-            return
+            k: Optional[int] = min(max(0, int(rhs.value)), 8)  # 8+ shifts all give 0
+        elif rhs.kind == "num":
+            k = self.const_u8(rhs.value)
+        else:
+            k = None
 
+        r = None
         if target.kind == "reg":
             r = target.value
             self.reg_ok(r)
+            if k is not None and r in self.reg_const:
+                # r's value is known: fold instead of LDI tmp + op (statements never
+                # leave flags for the next one, so losing the op's Z/C is fine)
+                self.emit_ldi(r, _FOLD_U8[op](self.reg_const[r], k))
+                return
+
+        plan = strength_reduce_u8(op, k) if k is not None else None
+        if plan is not None:
+            instr, n = plan
+            if instr is None:
+                return
+            dst = r or "A"
+            if instr == "LDI":
+                self.emit_ldi(dst, 0)
+            else:
+                if r is None:
+                    self.load_u8_into(self.target_as_operand(target), "A")
+                line = _FMT_OP1 % (instr, dst)
+                for _ in range(n):
+                    self.emit(line)
+            if r is None:
+                self.store_u8_from(target, "A")
+            return
+
+        if r is not None:
             tmp = self.choose_temp(avoid=r)
             self.load_u8_into(rhs, tmp, avoid=r)
-            asm_op = {"+=": "ADD", "-=": "SUB", "&=": "AND", "|=": "OR", "^=": "XOR"}[op]
-            self.emit(f"{asm_op} {r}, {tmp}")
+            self.emit(_FMT_OP2 % (_OP_ASSIGN_TO_ASM[op], r, tmp))
             return
 
         self.load_u8_into(self.target_as_operand(target), "A")
         self.load_u8_into(rhs, "B", avoid="A")
-        asm_op = {"+=": "ADD", "-=": "SUB", "&=": "AND", "|=": "OR", "^=": "XOR"}[op]
-        self.emit(f"{asm_op} A, B")
+        self.emit(_FMT_OP2 % (_OP_ASSIGN_TO_ASM[op], "A", "B"))
         self.store_u8_from(target, "A")
 
-    def apply_postfix(self, target: Target, op: str):
+    def apply_postfix(self, target: Target, op: str) -> None:
         if op not in ("++", "--"):
             raise ValueError("Invalid postfix op")
 
@@ -917,41 +1417,21 @@ class Codegen:
             self.emit("INC " + r if op == "++" else "DEC " + r)
             return
 
+        instr = "INC" if op == "++" else "DEC"
         if target.kind == "var":
-            name = target.value
-            t = self.vartype(name, target.line)
+            t = self.vartype(target)
             if t == "u16":
-                lo_lbl, hi_lbl = self.varlabels_u16(name, target.line)
-
-                self.emit(f"LDM B, {lo_lbl}")
-                self.emit(f"LDM A, {hi_lbl}")
-
-                if op == "++":
-                    done = self.new_label("u16_inc_done")
-                    self.emit("INC B")
-                    self.emit(f"JNZ {done}")
-                    self.emit("INC A")
-                    self.emit(f"{done}:")
-                else:
-                    no_borrow = self.new_label("u16_dec_no_borrow")
-                    self.emit("LDI C, 0")
-                    self.emit("CMP B, C")
-                    self.emit(f"JNZ {no_borrow}")
-                    self.emit("DEC A")
-                    self.emit(f"{no_borrow}:")
-                    self.emit("DEC B")
-
-                self.emit(f"STM {lo_lbl}, B")
-                self.emit(f"STM {hi_lbl}, A")
+                lo_lbl, hi_lbl = self.varlabels_u16(target)
+                # INC16/DEC16: assembler pseudo-instructions, expanded via A/B (see compil.PSEUDO16)
+                self.emit(_FMT_STEP16 % (instr, lo_lbl, hi_lbl))
                 return
 
-        instr = "INC" if op == "++" else "DEC"
         self.load_u8_into(self.target_as_operand(target), "A")
-        self.emit(f"{instr} A")
+        self.emit(_FMT_OP1 % (instr, "A"))
         self.store_u8_from(target, "A")
 
     # ---------- CALL / RET convention ----------
-    def emit_push_arg(self, arg_op: Operand, arg_type: str):
+    def emit_push_arg(self, arg_op: Operand, arg_type: str) -> None:
         if arg_type in ("u8", "char"):
             self.load_u8_into(arg_op, "A")
             self.emit("PUSH A")
@@ -971,22 +1451,30 @@ class Codegen:
           POP or POP16 into (A) or (A,B)
         Returns: (ret_width, hi_reg, lo_reg) where for 8-bit lo_reg is ''.
         """
-        info = self.funcs.get(call.value["name"])
+        fname = call.value.name
+        info = self.funcs.get(fname)
         if info is None:
-            raise ValueError(f"Unknown function {call.value['name']} at line {call.line}")
+            raise ValueError(f"Unknown function {fname} at line {call.line}")
 
-        fname = call.value["name"]
-        args: List[Operand] = call.value["args"]
+        args = call.value.args
         params = info["params"]
 
         if len(args) != len(params):
             raise ValueError(f"Function {fname} expects {len(params)} args, got {len(args)} (line {call.line})")
 
+        # the callee keeps its return address in O:P, so a call from a function body
+        # clobbers the caller's; calls to functions not yet compiled are refused here
+        if self.current_func is not None and not info["compiled"]:
+            raise ValueError(
+                f"Function {self.current_func} calls {fname} before it is defined (line {call.line}); "
+                f"nested calls may only target earlier functions"
+            )
+
         # push right-to-left
         for arg_op, p in zip(reversed(args), reversed(params)):
             self.emit_push_arg(arg_op, p["type"])
 
-        self.emit(f"CALL {fname}")
+        self.emit(_FMT_CALL % fname)
 
         retw = info["ret_width"]
         if expected_width != retw:
@@ -1002,7 +1490,7 @@ class Codegen:
             return retw, "A", "B"
 
     # ---------- assignment ----------
-    def apply_assign(self, target: Target, rhs: Operand):
+    def apply_assign(self, target: Target, rhs: Operand) -> None:
         # call expression
         if rhs.kind == "call":
             expected = self.width_of_target(target)
@@ -1017,14 +1505,14 @@ class Codegen:
             if target.kind == "regpair":
                 rp = target.value
                 self.regpair_ok(rp)
-                self.emit(f"MOV {rp[0]}, A")
-                self.emit(f"MOV {rp[1]}, B")
+                self.emit(_FMT_MOV % (rp[0], "A"))
+                self.emit(_FMT_MOV % (rp[1], "B"))
                 return
 
-            if target.kind == "var" and self.vartype(target.value, target.line) == "u16":
-                lo_lbl, hi_lbl = self.varlabels_u16(target.value, target.line)
-                self.emit(f"STM {lo_lbl}, B")
-                self.emit(f"STM {hi_lbl}, A")
+            if target.kind == "var" and self.width_of(target) == 16:
+                lo_lbl, hi_lbl = self.varlabels_u16(target)
+                self.emit(_FMT_STM % (lo_lbl, "B"))
+                self.emit(_FMT_STM % (hi_lbl, "A"))
                 return
 
             raise ValueError(f"Cannot assign 16-bit return value into {target.kind} (line {target.line})")
@@ -1037,38 +1525,38 @@ class Codegen:
             if rhs.kind == "regpair":
                 src = rhs.value
                 self.regpair_ok(src)
-                self.emit(f"MOV {hi}, {src[0]}")
-                self.emit(f"MOV {lo}, {src[1]}")
+                self.emit(_FMT_MOV % (hi, src[0]))
+                self.emit(_FMT_MOV % (lo, src[1]))
                 return
             if rhs.kind == "var":
-                lo_lbl, hi_lbl = self.varlabels_u16(rhs.value, rhs.line)
-                self.emit(f"LDM {lo}, {lo_lbl}")
-                self.emit(f"LDM {hi}, {hi_lbl}")
+                lo_lbl, hi_lbl = self.varlabels_u16(rhs)
+                self.emit(_FMT_LDM % (lo, lo_lbl))
+                self.emit(_FMT_LDM % (hi, hi_lbl))
                 return
             if rhs.kind == "num":
-                self.emit(f"LDI16 {rp}, {self.const_u16(rhs.value)}")
+                self.emit(_FMT_LDI16 % (rp, self.const_u16(rhs.value)))
                 return
             raise ValueError(f"Cannot assign {rhs.kind} to regpair at line {target.line}")
 
-        if target.kind == "var" and self.vartype(target.value, target.line) == "u16":
-            lo_lbl, hi_lbl = self.varlabels_u16(target.value, target.line)
+        if target.kind == "var" and self.width_of(target) == 16:
+            lo_lbl, hi_lbl = self.varlabels_u16(target)
             if rhs.kind == "regpair":
                 src = rhs.value
                 self.regpair_ok(src)
-                self.emit(f"STM {lo_lbl}, {src[1]}")
-                self.emit(f"STM {hi_lbl}, {src[0]}")
+                self.emit(_FMT_STM % (lo_lbl, src[1]))
+                self.emit(_FMT_STM % (hi_lbl, src[0]))
                 return
             if rhs.kind == "var":
-                src_lo, src_hi = self.varlabels_u16(rhs.value, rhs.line)
-                self.emit(f"LDM B, {src_lo}")
-                self.emit(f"LDM A, {src_hi}")
-                self.emit(f"STM {lo_lbl}, B")
-                self.emit(f"STM {hi_lbl}, A")
+                src_lo, src_hi = self.varlabels_u16(rhs)
+                self.emit(_FMT_LDM % ("B", src_lo))
+                self.emit(_FMT_LDM % ("A", src_hi))
+                self.emit(_FMT_STM % (lo_lbl, "B"))
+                self.emit(_FMT_STM % (hi_lbl, "A"))
                 return
             if rhs.kind == "num":
-                self.emit(f"LDI16 AB, {self.const_u16(rhs.value)}")
-                self.emit(f"STM {lo_lbl}, B")
-                self.emit(f"STM {hi_lbl}, A")
+                self.emit(_FMT_LDI16 % ("AB", self.const_u16(rhs.value)))
+                self.emit(_FMT_STM % (lo_lbl, "B"))
+                self.emit(_FMT_STM % (hi_lbl, "A"))
                 return
             raise ValueError(f"Cannot assign {rhs.kind} to u16 variable at line {target.line}")
 
@@ -1076,123 +1564,134 @@ class Codegen:
         self.load_u8_into(rhs, "A")
         self.store_u8_from(target, "A")
 
-    def apply_assign_not(self, target: Target, rhs: Operand):
+    def apply_assign_not(self, target: Target, rhs: Operand) -> None:
         self.load_u8_into(rhs, "A")
         self.emit("NOT A")
         self.store_u8_from(target, "A")
 
-    def apply_out(self, port: Operand, val: Operand, line: int):
+    def apply_out(self, port: Operand, val: Operand, line: int) -> None:
         if port.kind != "num":
             raise ValueError(f"out(port, ...) requires constant port at line {line}")
         p = port.value & 0xFF
         if val.kind == "reg":
             self.reg_ok(val.value)
-            self.emit(f"OUT {p}, {val.value}")
+            self.emit(_FMT_OUT % (p, val.value))
             return
         self.load_u8_into(val, "A")
-        self.emit(f"OUT {p}, A")
+        self.emit(_FMT_OUT % (p, "A"))
 
     # ---------- statements ----------
-    def compile_stmt_list(self, stmts: List[Stmt]):
+    def compile_stmt_list(self, stmts: List[Stmt]) -> None:
         for st in stmts:
             self.compile_stmt(st)
 
-    def compile_stmt(self, st: Stmt):
-        if st.kind == "let":
-            d: VarDecl = st.data
-            self.declare_var(d.name, d.vtype, d.line)
-            return
+    def compile_stmt(self, st: Stmt) -> None:
+        handler = self.stmt_dispatch.get(st.kind)
+        if handler is None:
+            raise ValueError(f"Unknown stmt kind {st.kind} at line {st.line}")
+        handler(st)
 
-        if st.kind == "assign":
-            self.apply_assign(st.data["target"], st.data["rhs"])
-            return
+    def stmt_let(self, st: Stmt) -> None:
+        d: VarDecl = st.data
+        self.declare_var(d.name, d.vtype, d.line)
 
-        if st.kind == "halt":
-            self.emit("HALT")
-            return
+    def stmt_assign(self, st: Stmt) -> None:
+        self.apply_assign(st.data.target, st.data.rhs)
 
-        if st.kind == "assign_not":
-            self.apply_assign_not(st.data["target"], st.data["rhs"])
-            return
+    def stmt_halt(self, st: Stmt) -> None:
+        self.emit("HALT")
 
-        if st.kind == "opassign":
-            target: Target = st.data["target"]
-            op: str = st.data["op"]
-            rhs: Operand = st.data["rhs"]
+    def stmt_assign_not(self, st: Stmt) -> None:
+        self.apply_assign_not(st.data.target, st.data.rhs)
 
-            if target.kind == "var" and self.vartype(target.value, target.line) == "u16":
-                raise ValueError(f"u16 op-assign not implemented yet (line {st.line})")
+    def stmt_opassign(self, st: Stmt) -> None:
+        target, op, rhs = st.data.target, st.data.op, st.data.rhs
 
-            if target.kind == "regpair":
-                raise ValueError(f"regpair op-assign not implemented yet (line {st.line})")
+        if target.kind == "var" and self.width_of(target) == 16:
+            raise ValueError(f"u16 op-assign not implemented yet (line {st.line})")
 
-            self.apply_opassign_u8(target, op, rhs)
-            return
+        if target.kind == "regpair":
+            raise ValueError(f"regpair op-assign not implemented yet (line {st.line})")
 
-        if st.kind == "postfix":
-            self.apply_postfix(st.data["target"], st.data["op"])
-            return
+        self.apply_opassign_u8(target, op, rhs)
 
-        if st.kind == "out":
-            self.apply_out(st.data["port"], st.data["val"], st.line)
-            return
+    def stmt_postfix(self, st: Stmt) -> None:
+        self.apply_postfix(st.data.target, st.data.op)
 
-        if st.kind == "if":
-            cond = st.data["cond"]
-            then_block = st.data["then"]
-            else_block = st.data["else"]
+    def stmt_out(self, st: Stmt) -> None:
+        self.apply_out(st.data.port, st.data.val, st.line)
 
-            lbl_else = self.new_label("else")
-            lbl_end = self.new_label("endif")
+    def stmt_if(self, st: Stmt) -> None:
+        cond, then_block, else_block = st.data.cond, st.data.then, st.data.else_
 
-            if else_block is None:
-                self.emit_cond_jump_false(cond, lbl_end)
-                self.compile_stmt_list(then_block)
-                self.emit(f"{lbl_end}:")
-            else:
-                self.emit_cond_jump_false(cond, lbl_else)
-                self.compile_stmt_list(then_block)
-                self.emit(f"JMP {lbl_end}")
-                self.emit(f"{lbl_else}:")
-                self.compile_stmt_list(else_block)
-                self.emit(f"{lbl_end}:")
-            return
+        lbl_else = self.new_label("else")
+        lbl_end = self.new_label("endif")
 
-        if st.kind == "while":
-            cond = st.data["cond"]
-            body = st.data["body"]
+        if else_block is None:
+            self.emit_cond_jump_false(cond, lbl_end)
+            self.compile_stmt_list(then_block)
+            self.emit(_FMT_LABEL % lbl_end)
+        else:
+            self.emit_cond_jump_false(cond, lbl_else)
+            self.compile_stmt_list(then_block)
+            self.emit(_FMT_JMP % lbl_end)
+            self.emit(_FMT_LABEL % lbl_else)
+            self.compile_stmt_list(else_block)
+            self.emit(_FMT_LABEL % lbl_end)
 
-            lbl_begin = self.new_label("while_begin")
-            lbl_end = self.new_label("while_end")
+    def stmt_while(self, st: Stmt) -> None:
+        cond, body = st.data.cond, st.data.body
 
-            self.emit(f"{lbl_begin}:")
-            self.emit_cond_jump_false(cond, lbl_end)
-            self.compile_stmt_list(body)
-            self.emit(f"JMP {lbl_begin}")
-            self.emit(f"{lbl_end}:")
-            return
+        lbl_begin = self.new_label("while_begin")
+        lbl_end = self.new_label("while_end")
 
-        raise ValueError(f"Unknown stmt kind {st.kind} at line {st.line}")
+        self.emit(_FMT_LABEL % lbl_begin)
+        self.emit_cond_jump_false(cond, lbl_end)
+        self.compile_stmt_list(body)
+        self.emit(_FMT_JMP % lbl_begin)
+        self.emit(_FMT_LABEL % lbl_end)
 
     # ---------- functions ----------
-    def register_funcs(self, funcs: List[FuncDef]):
+    def register_funcs(self, funcs: List[FuncDef]) -> None:
         for f in funcs:
             if f.name in self.funcs:
                 raise ValueError(f"Function {f.name} redeclared (line {f.line})")
             self.funcs[f.name] = {
                 "params": [{"name": p.name, "type": p.ptype, "line": p.line} for p in f.params],
-                "ret_width": None,
+                "ret_width": self.static_ret_width(f),
                 "line": f.line,
+                # set once the body is compiled; see compile_call_and_pop
+                "compiled": False,
             }
 
-    def compile_func(self, f: FuncDef):
+    def static_ret_width(self, f: FuncDef) -> Optional[int]:
+        # return width known before any body is compiled, so calls may precede the callee.
+        # A var is resolved against params and the body's top-level lets (the scope visible
+        # at `return`); anything else is left None for compile_func to report.
+        op: Operand = f.ret.data
+        if op.kind != "var":
+            return self.width_of(op)
+        vtype = None
+        for p in f.params:
+            if p.name == op.value:
+                vtype = p.ptype
+        for st in f.body:
+            if st.kind == "let" and st.data.name == op.value:
+                vtype = st.data.vtype
+        if vtype is None:
+            return None
+        return 16 if vtype == "u16" else 8
+
+    def compile_func(self, f: FuncDef) -> None:
         self.current_func = f.name
+        self._emit = self.func_asm.append
+        self._extend = self.func_asm.extend
+        self._gh_addr = None
+        self.reg_const.clear()
         self.push_scope()
 
-        # function label
-        self.emit(f"{f.name}:")
-        # prologue: pop return address
-        self.emit("POP16 OP")
+        # function label + prologue: pop return address
+        self.emit_many((_FMT_LABEL % f.name, "POP16 OP"))
 
         # declare params as variables in current scope (so body can use them as vars)
         for p in f.params:
@@ -1201,14 +1700,12 @@ class Codegen:
         # pop args left-to-right (arg1 first after retaddr removed)
         for p in f.params:
             if p.ptype in ("u8", "char"):
-                self.emit("POP A")
-                lbl = self.varlabel_u8(p.name, p.line)
-                self.emit(f"STM {lbl}, A")
+                (lbl,) = self.lookup_var(p.name).labels
+                self.emit_many(("POP A", _FMT_STM % (lbl, "A")))
             elif p.ptype == "u16":
-                self.emit("POP16 AB")  # A=HI, B=LO
-                lo_lbl, hi_lbl = self.varlabels_u16(p.name, p.line)
-                self.emit(f"STM {lo_lbl}, B")
-                self.emit(f"STM {hi_lbl}, A")
+                lo_lbl, hi_lbl = self.lookup_var(p.name).labels
+                # POP16 AB: A=HI, B=LO
+                self.emit_many(("POP16 AB", _FMT_STM % (lo_lbl, "B"), _FMT_STM % (hi_lbl, "A")))
             else:
                 raise ValueError(f"Invalid param type {p.ptype} in {f.name} (line {p.line})")
 
@@ -1221,71 +1718,75 @@ class Codegen:
 
         # record return width for callers
         self.funcs[f.name]["ret_width"] = retw
+        self.funcs[f.name]["compiled"] = True
 
+        # push the result, restore return address and ret
         if retw == 8:
             self.load_u8_into(ret_op, "A")
-            self.emit("PUSH A")
+            self.emit_many(("PUSH A", "PUSH16 OP", "RET"))
         else:
             self.load_u16_into(ret_op, hi_reg="A", lo_reg="B")
-            self.emit("PUSH16 AB")
-
-        # restore return address and ret
-        self.emit("PUSH16 OP")
-        self.emit("RET")
+            self.emit_many(("PUSH16 AB", "PUSH16 OP", "RET"))
 
         self.pop_scope()
         self.current_func = None
+        self._emit = self.main_asm.append
+        self._extend = self.main_asm.extend
+        self._gh_addr = None
+        self.reg_const.clear()
 
-    def compile_program(self, prog: Program):
+    def compile_program(self, prog: Program) -> None:
         # First pass: collect function signatures
         self.register_funcs(prog.funcs)
 
-        # Second: compile functions and infer return widths
+        # Second: compile function bodies
         for f in prog.funcs:
             self.compile_func(f)
 
-        # Validate all funcs got ret_width (should)
-        for name, info in self.funcs.items():
-            if info["ret_width"] is None:
-                raise ValueError(f"Internal: function {name} missing return width")
-
         # Compile main (global scope)
         self.current_func = None
+        self._emit = self.main_asm.append
+        self._extend = self.main_asm.extend
+        self._gh_addr = None
+        self.reg_const.clear()
         self.compile_stmt_list(prog.main)
 
+    def render_lines(self) -> Iterator[str]:
+        return chain(
+            RENDER_HEAD,
+            peephole(thread_jumps(self.func_asm)),
+            RENDER_MAIN,
+            peephole(thread_jumps(self.main_asm)),
+            RENDER_DATA,
+            render_data(self.data),
+        )
+
     def render(self) -> str:
-        out: List[str] = []
-        out.append("; ===== GENERATED ASM (HighLang -> ASM) =====")
-        out.append("")
-        start_lbl = "__start"
-        out.append(f"JMP {start_lbl}")
-        out.append("")
-        out.append("; ===== FUNCTIONS =====")
-        out.extend(self.func_asm)
-        out.append("")
-        out.append("; ===== MAIN =====")
-        out.append(f"{start_lbl}:")
-        out.extend(self.main_asm)
-        out.append("")
-        out.append("HALT")
-        out.append("")
-        out.append("; ===== DATA =====")
-        out.append("")
-        out.extend(self.data)
-        out.append("")
-        return "\n".join(out)
+        return "\n".join(chain(self.render_lines(), ("",)))
+
+    def write_to(self, stream: TextIO) -> int:
+        # same text as render(), written line by line instead of joined first; returns line count
+        n = 0
+        write = stream.write
+        for line in self.render_lines():
+            write(line)
+            write("\n")
+            n += 1
+        return n
 
 # =========================
 # Compiler entry
 # =========================
-def compile_highlang_text(src_text: str) -> str:
-    tokens = tokenize(src_text)
-    parser = Parser(tokens)
+def compile_highlang(src_text: str) -> Codegen:
+    parser = Parser(iter_tokens(src_text))
     prog = parser.parse_program()
 
     cg = Codegen()
     cg.compile_program(prog)
-    return cg.render()
+    return cg
+
+def compile_highlang_text(src_text: str) -> str:
+    return compile_highlang(src_text).render()
 
 def main():
     if len(sys.argv) < 3:
@@ -1297,13 +1798,15 @@ def main():
 
     src = inp.read_text(encoding="utf-8")
     try:
-        asm = compile_highlang_text(src)
+        cg = compile_highlang(src)
     except Exception as e:
         print(f"Compile error: {e}", file=sys.stderr)
         sys.exit(1)
 
-    outp.write_text(asm, encoding="utf-8")
-    print(f"Wrote ASM: {outp} ({len(asm.splitlines())} lines)")
+    # compile fully first so a failed compile leaves an existing output file alone
+    with outp.open("w", encoding="utf-8") as f:
+        n = cg.write_to(f)
+    print(f"Wrote ASM: {outp} ({n} lines)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,32 @@
+import unittest
+
+from minic import compile_highlang_text
+
+
+class LexerKeywordBoundaryTest(unittest.TestCase):
+    def test_keyword_glued_to_number_is_rejected(self):
+        # `0while` is NUM 0 + IDENT `while`, not NUM + WHILE: no keyword without a word boundary
+        # (`;` starts a comment, so the first form would also fail on the lost `}`)
+        for src in ("let: x = u8\nx = 0while (x < 1) { x++; }\n",
+                    "let: x = u8\nx = 0while (x < 1) { x++ }\n"):
+            with self.assertRaisesRegex(SyntaxError, "Expected OP, got LPAREN"):
+                compile_highlang_text(src)
+
+    def test_keyword_after_whitespace_still_lexes(self):
+        compile_highlang_text("let: x = u8\nx = 0 while (x < 1) { x++ }\n")
+
+
+
+class NestedCallTest(unittest.TestCase):
+    def test_call_to_later_function_from_body_is_rejected(self):
+        src = (
+            "func f(a: u8) {\n    let: r = u8\n    r = call g(a)\n    return r\n}\n"
+            "func g(b: u8) {\n    return b\n}\n"
+            "let: x = u8\nx = call f(1)\n"
+        )
+        with self.assertRaisesRegex(ValueError, "calls g before it is defined"):
+            compile_highlang_text(src)
+
+
+if __name__ == "__main__":
+    unittest.main()